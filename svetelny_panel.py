@@ -25,6 +25,8 @@ import time
 import math
 import cwiid
 import random
+import ctypes
+import multiprocessing
 
 def send_to_panel(command, answer=None, timeout=0.1): 
     """send command to panel
@@ -114,7 +116,220 @@ def set_panel_memory(rgb_string, from_pixel=0, timeout=0.1):
         else: 
             break
     return result
+
+"""compressed memblocks (rle)
+command "r<first pixel> <data length>\n" followed by data in groups:
+- run byte 1..127 and 3 bytes RRGGBB - run of pixels with the same color
+- run byte 0x80 + 1..127 (without color) - run of unchanged pixels
+panel answers "OK\n" like for "m" command
+"""
+# None - not tested yet, True/False - result of capability query
+_rle_supported = None
+
+def rle_supported(timeout=0.1): 
+    """capability query - firmware answers "caps rle\n" if it supports
+    compressed memblocks, old firmware doesn't know "caps" command
+    result is cached, panel_reset_caps() forgets it
+    """
+    global _rle_supported
+    if _rle_supported is None: 
+        _rle_supported = send_to_panel("caps\n", "rle", timeout)
+    return _rle_supported
+
+def panel_reset_caps(): 
+    """forget result of capability query (e.g. after firmware change)"""
+    global _rle_supported
+    _rle_supported = None
+
+def rle_groups(rgb_string, previous=None): 
+    """reference rle encoder
+    returns list of groups (strings) - see compressed memblocks
+    previous - rgb_string already in panel video memory,
+    unchanged pixels are skipped (delta compression)
+    trailing unchanged pixels are not encoded
+    """
+    rgb_string += "\x00" * (-len(rgb_string) % 3)
+    if previous is None: 
+        previous = ""
+    pixels = [rgb_string[i:i + 3] for i in range(0, len(rgb_string), 3)]
+    groups = []
+    index = 0
+    while index < len(pixels): 
+        pixel = pixels[index]
+        run = 1
+        if pixel == previous[index * 3:index * 3 + 3]: 
+            while index + run < len(pixels) and run < 127 and \
+                    pixels[index + run] == previous[(index + run) * 3:\
+                    (index + run) * 3 + 3]: 
+                run += 1
+            groups.append(chr(0x80 + run))
+        else: 
+            while index + run < len(pixels) and run < 127 and \
+                    pixels[index + run] == pixel: 
+                run += 1
+            groups.append(chr(run) + pixel)
+        index += run
+    while groups and len(groups[-1]) == 1: 
+        groups.pop()
+    return groups
+
+def rle_encode(rgb_string, previous=None): 
+    """reference rle encoder - returns compressed data (see rle_groups())"""
+    return "".join(rle_groups(rgb_string, previous))
+
+def rle_decode(data, memory="", from_pixel=0): 
+    """reference rle decoder (the same as firmware does)
+    data - compressed data, memory - panel video memory (rgb_string)
+    returns the new video memory
+    """
+    memory = list(memory)
+    pixel = from_pixel
+    index = 0
+    while index < len(data): 
+        run = ord(data[index])
+        if run & 0x80: 
+            pixel += run & 0x7f
+            index += 1
+        else: 
+            color = list(data[index + 1:index + 4])
+            memory += ["\x00"] * ((pixel + run) * 3 - len(memory))
+            for i in range(run): 
+                memory[(pixel + i) * 3:(pixel + i + 1) * 3] = color
+            pixel += run
+            index += 4
+    return "".join(memory)
+
+def set_panel_memory_rle(rgb_string, from_pixel=0, previous=None, \
+        timeout=0.1): 
+    """sending data into panel video memory with compressed memblocks
+    previous - rgb_string already in panel video memory (from from_pixel),
+    only changed pixels are sent
+    falls back to set_panel_memory() if firmware doesn't support rle
+    or if compressed data are not shorter than raw data
+    maximal data block length is 120B like in set_panel_memory()
+    !!! after data upload panel is NOT refreshed - panel_show() is required !!!
+    """
+    if not rle_supported(timeout): 
+        return set_panel_memory(rgb_string, from_pixel, timeout)
+    groups = rle_groups(rgb_string, previous)
+    if len("".join(groups)) >= len(rgb_string): 
+        return set_panel_memory(rgb_string, from_pixel, timeout)
+    memblock_len = 120
+    result = True
+    pixel = from_pixel
+    start = pixel
+    data = ""
+    for group in groups + [None]: 
+        if group is None or len(data) + len(group) > memblock_len: 
+            # memblock sending
+            if data: 
+                command = "r{} {}\n".format(start, len(data))
+                result = send_to_panel(command, command, timeout)
+                if result: 
+                    result = send_to_panel(data, "OK\n", timeout)
+                if not result: 
+                    break
+            data = ""
+            if group is None: 
+                break
+        if len(group) == 1: 
+            run = ord(group) & 0x7f
+            if not data: 
+                # leading unchanged pixels - start of memblock moving
+                pixel += run
+                continue
+        else: 
+            run = ord(group[0])
+        if not data: 
+            start = pixel
+        data += group
+        pixel += run
+    return result
     
+# shared frame buffers of a pipeline worker process (see effect_pipeline())
+_frame_buffers = None
+
+def _pipeline_init(buffers):
+    """worker process init - shared frame buffers storing"""
+    global _frame_buffers
+    _frame_buffers = buffers
+
+def _pipeline_render(effect, frame_number, slot):
+    """frame computing in a worker process
+    effect output is written into the shared buffer slot
+    returns length of the frame data
+    """
+    data = effect(frame_number)[:135 * 3]
+    _frame_buffers[slot].raw = data + "\x00" * (135 * 3 - len(data))
+    return len(data)
+
+def effect_pipeline(effect, count=1000, start_number=0, lookahead=4, \
+        processes=None, timeout=0.1):
+    """effect frames computing in a process pool
+    effect(frame_number) returns rgb_string (see set_panel_memory())
+    effect must be a module level function (it is sent to worker processes)
+    frames k+1..k+lookahead are computed in worker processes
+    and handed back through shared memory buffers,
+    the main process only uploads finished frames into the panel
+    (only changed pixels if firmware supports rle, see set_panel_memory_rle())
+    so effect complexity doesn't lower the frame rate on multi-core hosts
+    processes - number of worker processes (default is number of cpus)
+    """
+    buffers = [multiprocessing.RawArray(ctypes.c_char, 135 * 3) \
+            for slot in range(lookahead)]
+    pool = multiprocessing.Pool(processes, _pipeline_init, (buffers,))
+    pending = []
+    previous = None
+    result = True
+    begin_time = time.time()
+    try: 
+        for index in range(min(lookahead, count)): 
+            pending.append(pool.apply_async(_pipeline_render, \
+                    (effect, start_number + index, index % lookahead)))
+        for index in range(count): 
+            slot = index % lookahead
+            data_len = pending.pop(0).get()
+            data = buffers[slot].raw[:data_len]
+            result = set_panel_memory_rle(data, 0, previous, timeout)
+            previous = data
+            if result: 
+                result = panel_show()
+            if not result: 
+                break
+            # the slot is free - next frame computing
+            if index + lookahead < count: 
+                pending.append(pool.apply_async(_pipeline_render, \
+                        (effect, start_number + index + lookahead, slot)))
+    finally: 
+        pool.terminate()
+        pool.join()
+    end_time = time.time()
+    if result: 
+        print "{} changes".format(count)
+        print "total time {} seconds".format(end_time - begin_time)
+        print "one change period {} seconds".format((end_time - begin_time) \
+                / count)
+    return result
+
+def plasma(frame_number): 
+    """plasma effect frame for effect_pipeline()
+    returns rgb_string of the whole panel
+    """
+    t = frame_number / 10.
+    pixels = [""] * 135
+    for row in range(9): 
+        for col in range(15): 
+            v = math.sin(col / 2. + t) + math.sin(row / 1.5 + t / 2.) + \
+                    math.sin((col + row + t) / 3.) + \
+                    math.sin(math.sqrt(col * col + row * row) / 2. - t)
+            pixels[matrix(row, col)] = \
+                    chr(int(127.5 + 127.5 * math.sin(v * math.pi / 2))) + \
+                    chr(int(127.5 + 127.5 * math.sin(v * math.pi / 2 + \
+                    math.pi * 2 / 3))) + \
+                    chr(int(127.5 + 127.5 * math.sin(v * math.pi / 2 + \
+                    math.pi * 4 / 3)))
+    return "".join(pixels)
+
 def setup(speed=115200):
   # Start Serial2 at speed baud:
   Serial2.begin(speed)